@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Write side of pullmetadata.py: fix chapter titles/urls, the chapter TOC and
+# text frames in a Forecast MP3 without re-exporting it.
+#
+# If the new tag fits in the space of the old one (thanks to the ID3 padding)
+# only the tag region at the start of the file is rewritten.  Otherwise the
+# file is streamed into a copy with a fresh padding reserve so the next fix
+# will fit in place.
+
+import os
+import io
+import json
+import shutil
+import struct
+import tempfile
+from mutagen import id3
+from argparse import ArgumentParser as ArgParser
+
+from pullmetadata import PodcastMetadata
+import instrumentation
+from instrumentation import metrics
+
+__version__ = '1.0.0'
+debug = False
+
+# Padding left after a rewrite, room for plenty of chapter fixes later on
+DEFAULT_RESERVE = 16 * 1024
+COPY_BUFSIZE = 1024 * 1024
+CHAPTER_URL = 'WXXX:chapter url'
+CHAPTER_TIMES = ['start_time', 'end_time', 'start_offset', 'end_offset']
+
+# mutagen keeps these as their v2.4 replacement in memory and converts them
+# back when saving as v2.3, so they are always edited through the replacement
+V24_REPLACEMENTS = {'TYER': 'TDRC'}
+# Frames that only exist in one version, mutagen drops them when saving the other
+V23_ONLY = ['EQUA', 'IPLS', 'RVAD', 'TDAT', 'TIME', 'TORY', 'TRDA', 'TSIZ', 'TYER']
+V24_ONLY = ['ASPI', 'EQU2', 'RVA2', 'SEEK', 'SIGN', 'TDEN', 'TDRL', 'TDTG', 'TMOO',
+            'TPRO', 'TSOA', 'TSOP', 'TSOT', 'TSST']
+
+
+def readTagSize(fileobj):
+    # Size of the ID3v2 tag region at the start of the file (header, frames,
+    # padding and footer), 0 if there is no tag
+    fileobj.seek(0)
+    header = fileobj.read(10)
+    if len(header) != 10 or not header.startswith(b'ID3'):
+        return 0
+    flags = header[5]
+    size = 0
+    for b in struct.unpack('>4B', header[6:10]):
+        size = (size << 7) | (b & 0x7f)
+    size += 10
+    if flags & 0x10:
+        size += 10
+    return size
+
+
+class PodcastMetadataWriter:
+    def __init__(self, inputfile, reserve=DEFAULT_RESERVE):
+        self.inputfile = inputfile
+        self.reserve = reserve
+        self.tags = None
+        self.changed = False
+
+    def load(self):
+        with metrics.timer('file_open'):
+            f = open(self.inputfile, 'rb')
+        with f:
+            with metrics.timer('tag_parse'):
+                # leave the ID3v1 trailer out, it is kept as is and must not be merged into the v2 tag
+                self.tags = id3.ID3(f, load_v1=False)
+        self.changed = False
+        return self
+
+    def getChapter(self, element_id):
+        for chap in self.tags.getall('CHAP'):
+            if chap.element_id == element_id:
+                return chap
+        raise Exception("{}: no chapter {}".format(self.inputfile, element_id))
+
+    def setChapterTitle(self, element_id, title):
+        chap = self.getChapter(element_id)
+        current = chap.sub_frames.get('TIT2')
+        if current is not None and current.text == [title]:
+            return
+        chap.sub_frames.setall('TIT2', [id3.TIT2(encoding=3, text=[title])])
+        self.changed = True
+
+    def setChapterURL(self, element_id, url):
+        chap = self.getChapter(element_id)
+        current = chap.sub_frames.get(CHAPTER_URL)
+        if url:
+            if current is not None and current.url == url:
+                return
+            chap.sub_frames.setall(CHAPTER_URL, [id3.WXXX(encoding=3, desc='chapter url', url=url)])
+        else:
+            if current is None:
+                return
+            chap.sub_frames.delall(CHAPTER_URL)
+        self.changed = True
+
+    def setChapterTimes(self, element_id, times):
+        chap = self.getChapter(element_id)
+        for name, value in times.items():
+            if name not in CHAPTER_TIMES:
+                raise Exception("{}: unknown chapter field {}".format(element_id, name))
+            if getattr(chap, name) != int(value):
+                setattr(chap, name, int(value))
+                self.changed = True
+
+    def setChapterTOC(self, child_element_ids):
+        ctocs = self.tags.getall('CTOC')
+        if len(ctocs) == 0:
+            raise Exception("{}: no chapter TOC".format(self.inputfile))
+        for element_id in child_element_ids:
+            self.getChapter(element_id)
+        if ctocs[0].child_element_ids == list(child_element_ids):
+            return
+        ctocs[0].child_element_ids = list(child_element_ids)
+        self.changed = True
+
+    def targetVersion(self):
+        # ID3v2.2 and v2.3 tags are written back as v2.3, v2.4 stays v2.4
+        if self.tags.version < (2, 4, 0):
+            return 3
+        return 4
+
+    def frameText(self, frame):
+        # text of a frame in the form setText() takes it, timestamps as strings
+        if isinstance(frame, id3.USLT):
+            return frame.text
+        return [str(t) for t in frame.text]
+
+    def setText(self, frameid, value):
+        frameid = V24_REPLACEMENTS.get(frameid, frameid)
+        cls = getattr(id3, frameid, None)
+        if cls is None or cls not in PodcastMetadata.texttypes + PodcastMetadata.tstypes:
+            raise Exception("{}: not a text frame".format(frameid))
+        if self.targetVersion() == 4 and frameid in V23_ONLY or \
+                self.targetVersion() == 3 and frameid in V24_ONLY:
+            raise Exception("{}: not supported in ID3v2.{} tags".format(frameid, self.targetVersion()))
+        if isinstance(value, str) and cls is not id3.USLT:
+            value = [value]
+        if cls in PodcastMetadata.tstypes:
+            for v in value:
+                if id3.ID3TimeStamp(v).year is None:
+                    raise Exception("{}: not a timestamp: {}".format(frameid, v))
+
+        # Only the plain comment/lyrics frame (no description, english) is
+        # edited, the ones with a description (e.g. iTunNORM) are left alone
+        if cls is id3.COMM or cls is id3.USLT:
+            key = frameid + '::eng'
+        else:
+            key = frameid
+        frames = self.tags.getall(key)
+        if len(frames) > 0 and all(self.frameText(f) == value for f in frames):
+            return
+        if len(frames) == 0:
+            if cls is id3.COMM or cls is id3.USLT:
+                frames = [cls(encoding=3, lang='eng', desc='')]
+            else:
+                frames = [cls(encoding=3)]
+        for f in frames:
+            f.encoding = 3
+            f.text = value
+        self.tags.setall(key, frames)
+        self.changed = True
+
+    def applyMetadata(self, metadata):
+        # Takes the same shape of dict PodcastMetadata.extractMetadata() returns,
+        # so the JSON output of pullmetadata.py can be edited and fed back in.
+        # Only the keys present are changed, anything that can't be written raises.
+        for key, value in metadata.items():
+            if key == 'CHAP':
+                for element_id, ch in value.items():
+                    times = dict(ch)
+                    if 'text' in times:
+                        self.setChapterTitle(element_id, times.pop('text'))
+                    if 'url' in times:
+                        self.setChapterURL(element_id, times.pop('url'))
+                    if times:
+                        self.setChapterTimes(element_id, times)
+            elif key == 'CTOC':
+                self.setChapterTOC(value)
+            elif key == 'APIC':
+                continue
+            else:
+                self.setText(key, value)
+
+    def renderTag(self, available):
+        # Render the tag into memory, padded out to exactly the available
+        # space if it fits, otherwise with the padding reserve
+        def padding(info):
+            # rendered into an empty buffer, so the negative padding is the tag size
+            needed = -info.padding
+            if needed <= available:
+                return available - needed
+            return self.reserve
+
+        v2_version = self.targetVersion()
+        if v2_version == 3:
+            self.tags.update_to_v23()
+        buf = io.BytesIO()
+        self.tags.save(buf, v1=0, v2_version=v2_version, padding=padding)
+        return buf.getvalue()
+
+    def save(self):
+        """
+        writes the changed tag back, returns "in place" when only the tag region
+        was rewritten or "rewrite" when the whole file had to be copied
+        """
+        with metrics.timer('tag_write'):
+            with open(self.inputfile, 'rb') as f:
+                available = readTagSize(f)
+            with metrics.timer('tag_render'):
+                data = self.renderTag(available)
+
+            if available > 0 and len(data) == available:
+                with open(self.inputfile, 'r+b') as f:
+                    f.write(data)
+                metrics.count('tag_bytes_written', len(data))
+                metrics.count('tag_inplace')
+                self.changed = False
+                return "in place"
+
+            dirname = os.path.dirname(os.path.abspath(self.inputfile))
+            fd, tmpfile = tempfile.mkstemp(dir=dirname, prefix=".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'wb') as dst, open(self.inputfile, 'rb') as src:
+                    dst.write(data)
+                    src.seek(available)
+                    shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+                    written = dst.tell()
+                shutil.copymode(self.inputfile, tmpfile)
+                os.replace(tmpfile, self.inputfile)
+            except BaseException:
+                os.unlink(tmpfile)
+                raise
+            metrics.count('tag_bytes_written', written)
+            metrics.count('tag_rewrite')
+            self.changed = False
+            return "rewrite"
+
+
+def version():
+    print("Version: {}".format(__version__))
+
+
+def splitAssignment(value):
+    if '=' not in value:
+        raise Exception("expected ID=VALUE, got: {}".format(value))
+    return value.split('=', 1)
+
+
+def parseCommandLine():
+    global debug
+    description = (
+            'Script to fix the metadata of a Podcast in place, '
+            'chapter titles, urls, TOC and text frames.\n'
+            '---------------------------------------------'
+            '-----------------------------\n'
+            )
+    parser = ArgParser(description=description)
+    parser.add_argument('-v', '--version', action='store_true', help='Show version numbers and exit')
+    parser.add_argument('-i', '--inputfile', action='append', help='Podcast file to fix, can be repeated')
+    parser.add_argument('-j', '--json', help='Apply a (partial) pullmetadata.py JSON file to the podcast')
+    parser.add_argument('-t', '--chapter-title', action='append', default=[], metavar='ID=TITLE',
+                        help='Set the title of a chapter, can be repeated')
+    parser.add_argument('-u', '--chapter-url', action='append', default=[], metavar='ID=URL',
+                        help='Set the url of a chapter, empty URL removes it, can be repeated')
+    parser.add_argument('-f', '--frame', action='append', default=[], metavar='FRAME=TEXT',
+                        help='Set a text frame, e.g. TIT2=Title, can be repeated')
+    parser.add_argument('--toc', metavar='ID,ID,...', help='Set the chapter order of the TOC')
+    parser.add_argument('-r', '--reserve', type=int, default=DEFAULT_RESERVE,
+                        help='Padding to leave when the file has to be rewritten')
+    parser.add_argument('-d', '--debug', action='store_true', help='Show the changes but do not write them')
+    instrumentation.addArguments(parser)
+
+    options = parser.parse_args()
+    if isinstance(options, tuple):
+        args = options[0]
+    else:
+        args = options
+    del options
+
+    if args.version:
+        version()
+
+    metrics.configure(args)
+
+    if args.debug:
+        debug = args.debug
+
+    if not args.inputfile:
+        print("inputfile cannot be empty")
+        raise SystemExit()
+
+    fixes = dict()
+    if args.json:
+        with open(args.json) as f:
+            fixes = json.load(f)
+    for value in args.frame:
+        frameid, text = splitAssignment(value)
+        fixes[frameid] = text
+    for value in args.chapter_title:
+        element_id, text = splitAssignment(value)
+        fixes.setdefault('CHAP', dict()).setdefault(element_id, dict())['text'] = text
+    for value in args.chapter_url:
+        element_id, url = splitAssignment(value)
+        fixes.setdefault('CHAP', dict()).setdefault(element_id, dict())['url'] = url
+    if args.toc:
+        fixes['CTOC'] = args.toc.split(',')
+
+    for inputfile in args.inputfile:
+        writer = PodcastMetadataWriter(inputfile, args.reserve).load()
+        writer.applyMetadata(fixes)
+        if debug:
+            print("{}:".format(inputfile))
+            print(writer.tags.pprint())
+        elif writer.changed:
+            print("{}: {}".format(inputfile, writer.save()))
+
+
+def main():
+    try:
+        parseCommandLine()
+    except KeyboardInterrupt:
+        print("\nCancelling...\n")
+    except Exception as e:
+        print(e)
+        raise SystemExit(-1)
+    finally:
+        metrics.finish()
+
+
+if __name__ == '__main__':
+    main()
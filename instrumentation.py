@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Timing and network counters shared by pullmetadata.py, posttobsky.py and publish.py
+#
+# Every tool adds the same command line switches with addArguments(), calls
+# metrics.configure(args) once the arguments are parsed and metrics.finish()
+# at the end of the run, which writes the summary and/or cProfile output.
+
+import os
+import sys
+import time
+import json
+import cProfile
+import pstats
+import functools
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import requests
+
+METRICS_FORMATS = ['JSON', 'PROM']
+
+
+def addArguments(parser):
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='Write a summary of timings and network usage to FILE, - for stderr')
+    parser.add_argument('--metrics-format', choices=METRICS_FORMATS, type=str.upper,
+                        help='Format of the metrics summary: JSON or PROM (Prometheus textfile). '
+                             'Default is PROM for .prom files, JSON otherwise')
+    parser.add_argument('--profile', metavar='FILE', nargs='?', const='-',
+                        help='Run under cProfile, print the hot spots to stderr or dump the stats to FILE')
+
+
+def endpointName(method, url):
+    path = urlparse(url).path
+    if "/xrpc/" in path:
+        return "xrpc " + path.split("/xrpc/", 1)[1]
+    return "http {} {}".format(method.upper(), urlparse(url).netloc)
+
+
+def bodySize(body):
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode("UTF-8"))
+    try:
+        return len(body)
+    except TypeError:
+        # streamed bodies (generators/files) can't be measured up front
+        return 0
+
+
+class Metrics:
+    def __init__(self):
+        self.tool = os.path.splitext(os.path.basename(sys.argv[0]))[0] or "python"
+        self.started = time.perf_counter()
+        self.timings = dict()
+        self.counters = dict()
+        self.calls = []
+        self.metricsfile = None
+        self.metricsformat = None
+        self.profilefile = None
+        self.profiler = None
+
+    def configure(self, args):
+        self.tool = os.path.splitext(os.path.basename(sys.argv[0]))[0] or self.tool
+        self.metricsfile = getattr(args, 'metrics', None)
+        self.metricsformat = getattr(args, 'metrics_format', None)
+        self.profilefile = getattr(args, 'profile', None)
+        if self.profilefile and self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def record(self, op, seconds):
+        t = self.timings.get(op)
+        if t is None:
+            t = {'count': 0, 'total': 0.0, 'min': seconds, 'max': seconds}
+            self.timings[op] = t
+        t['count'] += 1
+        t['total'] += seconds
+        t['min'] = min(t['min'], seconds)
+        t['max'] = max(t['max'], seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, op):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(op, time.perf_counter() - start)
+
+    def timed(self, op):
+        # Decorator version of timer()
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(op):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def request(self, method, url, **kwargs):
+        # Drop in for requests.request() that times the call and counts the traffic
+        op = endpointName(method, url)
+        start = time.perf_counter()
+        status = "error"
+        sent = 0
+        received = 0
+        try:
+            resp = requests.request(method, url, **kwargs)
+            status = str(resp.status_code)
+            sent = bodySize(resp.request.body)
+            received = len(resp.content)
+            return resp
+        finally:
+            seconds = time.perf_counter() - start
+            self.record(op, seconds)
+            self.count('http_requests')
+            self.count('http_bytes_sent', sent)
+            self.count('http_bytes_received', received)
+            self.calls.append({'op': op, 'status': status, 'seconds': seconds,
+                               'bytes_sent': sent, 'bytes_received': received})
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def summary(self):
+        return {
+            'tool': self.tool,
+            'wall_time': time.perf_counter() - self.started,
+            'timings': self.timings,
+            'http': {
+                'requests': self.counters.get('http_requests', 0),
+                'bytes_sent': self.counters.get('http_bytes_sent', 0),
+                'bytes_received': self.counters.get('http_bytes_received', 0),
+                'retries': self.counters.get('retries', 0),
+                'calls': self.calls,
+            },
+            'counters': self.counters,
+        }
+
+    def prometheus(self):
+        tool = self.tool.replace('\\', '\\\\').replace('"', '\\"')
+        lines = [
+            '# HELP podcasttools_run_seconds Wall time of the whole run',
+            '# TYPE podcasttools_run_seconds gauge',
+            'podcasttools_run_seconds{{tool="{}"}} {:.6f}'.format(tool, time.perf_counter() - self.started),
+            '# HELP podcasttools_duration_seconds Wall time spent per operation',
+            '# TYPE podcasttools_duration_seconds summary',
+        ]
+        for op, t in sorted(self.timings.items()):
+            labels = '{{tool="{}",op="{}"}}'.format(tool, op.replace('"', '\\"'))
+            lines.append('podcasttools_duration_seconds_sum{} {:.6f}'.format(labels, t['total']))
+            lines.append('podcasttools_duration_seconds_count{} {}'.format(labels, t['count']))
+        lines.append('# HELP podcasttools_events_total Requests, bytes and retries counted during the run')
+        lines.append('# TYPE podcasttools_events_total counter')
+        for name, n in sorted(self.counters.items()):
+            lines.append('podcasttools_events_total{{tool="{}",event="{}"}} {}'.format(tool, name, n))
+        return "\n".join(lines) + "\n"
+
+    def writeSummary(self):
+        fmt = self.metricsformat
+        if fmt is None:
+            fmt = 'PROM' if self.metricsfile.endswith('.prom') else 'JSON'
+        if fmt == 'PROM':
+            text = self.prometheus()
+        else:
+            text = json.dumps(self.summary(), indent=2) + "\n"
+
+        if self.metricsfile == '-':
+            sys.stderr.write(text)
+            return
+        # write then rename, the node_exporter textfile collector must never see a partial file
+        tmpfile = self.metricsfile + ".tmp"
+        with open(tmpfile, "w") as f:
+            f.write(text)
+        os.replace(tmpfile, self.metricsfile)
+
+    def writeProfile(self):
+        self.profiler.disable()
+        if self.profilefile == '-':
+            stats = pstats.Stats(self.profiler, stream=sys.stderr)
+            stats.sort_stats('cumulative').print_stats(30)
+        else:
+            self.profiler.dump_stats(self.profilefile)
+
+    def finish(self):
+        if self.profiler is not None:
+            self.writeProfile()
+            self.profiler = None
+        if self.metricsfile:
+            self.writeSummary()
+            self.metricsfile = None
+
+
+metrics = Metrics()
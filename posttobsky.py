@@ -10,11 +10,12 @@ import re
 from argparse import ArgumentParser as ArgParser
 from typing import Dict, List
 from datetime import datetime, timezone
-import requests
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 
 from pullmetadata import PodcastMetadata
+import instrumentation
+from instrumentation import metrics
 
 __version__ = '1.0.0'
 debug:bool = False
@@ -29,9 +30,11 @@ useragent:str = "MostlySecurityBot/1.0 (https://mostlysecurity.com/; podcast@mos
 class BlueskyPostBot:
     def __init__(self, configfile):
         self.configfile = configfile
+        self.pds_url = None
+        self.session = None
 
     def bsky_login_session(self, pds_url: str, handle: str, password: str) -> Dict:
-        resp = requests.post(
+        resp = metrics.post(
             pds_url + "/xrpc/com.atproto.server.createSession",
             json={"identifier": handle, "password": password},
         )
@@ -80,7 +83,7 @@ class BlueskyPostBot:
         """
         facets = []
         for m in self.parse_mentions(text):
-            resp = requests.get(
+            resp = metrics.get(
                 pds_url + "/xrpc/com.atproto.identity.resolveHandle",
                 params={"handle": m["handle"]},
             )
@@ -135,7 +138,7 @@ class BlueskyPostBot:
 
     def get_reply_refs(self, pds_url: str, parent_uri: str) -> Dict:
         uri_parts = self.parse_uri(parent_uri)
-        resp = requests.get(
+        resp = metrics.get(
             pds_url + "/xrpc/com.atproto.repo.getRecord",
             params=uri_parts,
         )
@@ -146,7 +149,7 @@ class BlueskyPostBot:
         if parent_reply is not None:
             root_uri = parent_reply["root"]["uri"]
             root_repo, root_collection, root_rkey = root_uri.split("/")[2:5]
-            resp = requests.get(
+            resp = metrics.get(
                 pds_url + "/xrpc/com.atproto.repo.getRecord",
                 params={
                     "repo": root_repo,
@@ -180,7 +183,7 @@ class BlueskyPostBot:
             mimetype = "image/webp"
 
         # WARNING: a non-naive implementation would strip EXIF metadata from JPEG files here by default
-        resp = requests.post(
+        resp = metrics.post(
             pds_url + "/xrpc/com.atproto.repo.uploadBlob",
             headers={
                 "Content-Type": mimetype,
@@ -220,7 +223,7 @@ class BlueskyPostBot:
 
         # fetch the HTML
         headers = {"User-Agent": useragent}
-        resp = requests.get(url, headers=headers)
+        resp = metrics.get(url, headers=headers)
         resp.raise_for_status()
         soup = BeautifulSoup(resp.text, "html.parser")
 
@@ -237,7 +240,7 @@ class BlueskyPostBot:
             img_url = image_tag["content"]
             if "://" not in img_url:
                 img_url = url + img_url
-            resp = requests.get(img_url, headers=headers)
+            resp = metrics.get(img_url, headers=headers)
             resp.raise_for_status()
             card["thumb"] = self.upload_file(pds_url, access_token, img_url, resp.content)
 
@@ -249,7 +252,7 @@ class BlueskyPostBot:
 
     def get_embed_ref(self, pds_url: str, ref_uri: str) -> Dict:
         uri_parts = self.parse_uri(ref_uri)
-        resp = requests.get(
+        resp = metrics.get(
             pds_url + "/xrpc/com.atproto.repo.getRecord",
             params=uri_parts,
         )
@@ -283,16 +286,25 @@ class BlueskyPostBot:
         # )
 
 
-    def create_post(self, text, link=None, useimage=True):
-        load_dotenv(self.configfile, override=True)
-        pds_url=os.environ.get("ATP_PDS_HOST") or "https://bsky.social"
-        handle=os.environ.get("ATP_AUTH_HANDLE")
-        password=os.environ.get("ATP_AUTH_PASSWORD")
-        if len(handle) <= 0 or len(password) <= 0:
-            print(f"Need handle and password")
-            return 
+    def login(self):
+        # Log in once and reuse the session for every post made by this bot
+        if self.session is None:
+            load_dotenv(self.configfile, override=True)
+            pds_url=os.environ.get("ATP_PDS_HOST") or "https://bsky.social"
+            handle=os.environ.get("ATP_AUTH_HANDLE")
+            password=os.environ.get("ATP_AUTH_PASSWORD")
+            if not handle or not password:
+                print(f"Need handle and password")
+                return None, None
+            self.session = self.bsky_login_session(pds_url, handle, password)
+            self.pds_url = pds_url
+        return self.pds_url, self.session
+
 
-        session = self.bsky_login_session(pds_url, handle, password)
+    def create_post(self, text, link=None, useimage=True):
+        pds_url, session = self.login()
+        if session is None:
+            return
 
         # trailing "Z" is preferred over "+00:00"
         now = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
@@ -330,7 +342,7 @@ class BlueskyPostBot:
         print("creating post:", file=sys.stderr)
         print(json.dumps(post, indent=2), file=sys.stderr)
 
-        resp = requests.post(
+        resp = metrics.post(
             pds_url + "/xrpc/com.atproto.repo.createRecord",
             headers={"Authorization": "Bearer " + session["accessJwt"], 'User-Agent': useragent},
             json={
@@ -344,12 +356,16 @@ class BlueskyPostBot:
             print(f"createRecord response {resp.status_code}:", file=sys.stderr)
             print(json.dumps(resp.json(), indent=2))
             # resp.raise_for_status()
+            if not useimage:
+                return None
             print("Trying again without images")
-            self.create_post(text, link, useimage=False)
+            metrics.count('retries')
+            return self.create_post(text, link, useimage=False)
         else:
             print("createRecord response:", file=sys.stderr)
             print(json.dumps(resp.json(), indent=2))
             resp.raise_for_status()
+            return resp.json()
 
 # def parseCommandLine_old():
 #     parser = ArgParser(description="bsky.app post upload example script")
@@ -387,6 +403,14 @@ def postToBsky(bskybot, text, url):
     else:
         bskybot.create_post(text, url)
 
+def episodeTitle(title: str, episode: int) -> str:
+    if title.startswith(f"Episode {episode}:"):
+        return title
+    elif title.startswith(f"{episode}:"):
+        return f"Episode {episode}: {title[4:].strip()}"
+    else:
+        return f"Episode {episode}: {title}"
+
 def postMetadata(bskybot, metadata: dict):
     global title
     # Create Chapter Posts
@@ -417,6 +441,7 @@ def parseCommandLine():
     parser.add_argument('-e', '--episode', type=int, help='Episode number')
     parser.add_argument('-p', '--podcasturl', help='URL to podcast for posting to bluesky')
     parser.add_argument('-d', '--debug', action='store_true', help='Prints extra stuff to stdout')
+    instrumentation.addArguments(parser)
     
     options = parser.parse_args()
     if isinstance(options, tuple):
@@ -428,6 +453,8 @@ def parseCommandLine():
     if args.version:
         version()
     
+    metrics.configure(args)
+
     if args.debug:
         debug = args.debug
 
@@ -463,14 +490,8 @@ def main():
             raise SystemExit(-1)
 
         if podcasturl:
-            post_title = title
             if episode > 0:
-                if title.startswith(f"Episode {episode}:"):
-                    post_title = title
-                elif title.startswith(f"{episode}:"):
-                    post_title = f"Episode {episode}: {title[4:].strip()}"
-                else:
-                    post_title = f"Episode {episode}: {title}"
+                post_title = episodeTitle(title, episode)
             else:
                 print(f"Missing episode number")
                 raise SystemExit(-1)
@@ -479,6 +500,8 @@ def main():
 
     except Exception as e:
         print(e)
+    finally:
+        metrics.finish()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# One-shot publishing of an episode: extract -> render -> build -> post
+#
+# Every stage writes its output into the work directory, so any stage can be
+# rerun on its own (e.g. "-S post" after fixing config.env) without re-parsing
+# the MP3 or rebuilding the earlier artifacts.
+
+import os
+import sys
+import json
+from argparse import ArgumentParser as ArgParser
+
+from pullmetadata import PodcastMetadata, renderMarkdown, renderHTML
+from posttobsky import BlueskyPostBot, episodeTitle
+import instrumentation
+from instrumentation import metrics
+
+__version__ = '1.0.0'
+
+STAGES = ['extract', 'render', 'build', 'post']
+
+METADATA_FILE = 'metadata.json'
+SHOWNOTES_HTML_FILE = 'shownotes.html'
+SHOWNOTES_MD_FILE = 'shownotes.md'
+POSTS_FILE = 'posts.json'
+POSTED_FILE = 'posted.json'
+
+
+class PodcastPublisher:
+    def __init__(self, workdir, inputfile="", configfile="config.env", title="", episode=0,
+                 podcasturl="", showtime=False, debug=False):
+        self.workdir = workdir
+        self.inputfile = inputfile
+        self.configfile = configfile
+        self.title = title
+        self.episode = episode
+        self.podcasturl = podcasturl
+        self.showtime = showtime
+        self.debug = debug
+        # Shared state between the stages, loaded from the work directory
+        # when a stage runs without the ones before it
+        self.metadata = None
+        self.posts = None
+        self.bskybot = None
+
+    def artifact(self, name):
+        return os.path.join(self.workdir, name)
+
+    def loadArtifact(self, name, stage):
+        path = self.artifact(name)
+        if not os.path.exists(path):
+            raise Exception(f"{path} not found, run the '{stage}' stage first")
+        with open(path) as f:
+            return json.load(f)
+
+    def saveArtifact(self, name, data):
+        path = self.artifact(name)
+        tmppath = path + ".tmp"
+        with open(tmppath, "w") as f:
+            if isinstance(data, str):
+                f.write(data)
+            else:
+                json.dump(data, f, indent=2)
+        os.replace(tmppath, path)
+        print(f"wrote {path}", file=sys.stderr)
+
+    def getMetadata(self):
+        if self.metadata is None:
+            self.metadata = self.loadArtifact(METADATA_FILE, 'extract')
+        return self.metadata
+
+    def getPosts(self):
+        if self.posts is None:
+            self.posts = self.loadArtifact(POSTS_FILE, 'build')
+        return self.posts
+
+    def extract(self):
+        if not self.inputfile:
+            raise Exception("inputfile is required for the 'extract' stage")
+        podcast = PodcastMetadata(self.inputfile)
+        self.metadata = podcast.extractMetadata()
+        self.saveArtifact(METADATA_FILE, self.metadata)
+
+    def render(self):
+        metadata = self.getMetadata()
+        self.saveArtifact(SHOWNOTES_HTML_FILE, renderHTML(metadata, self.showtime) + "\n")
+        self.saveArtifact(SHOWNOTES_MD_FILE, renderMarkdown(metadata, self.showtime) + "\n")
+
+    def build(self):
+        metadata = self.getMetadata()
+        posts = []
+        # Chapter posts
+        for i in metadata['CTOC']:
+            ch = metadata['CHAP'][i]
+            if ch.get('url'):
+                posts.append({'text': ch['text'], 'url': ch['url']})
+        # Podcast post
+        if self.podcasturl:
+            title = self.title or metadata.get('TIT2', "")
+            if len(title) <= 0:
+                raise Exception("Missing title")
+            if self.episode <= 0:
+                raise Exception("Missing episode number")
+            posts.append({'text': episodeTitle(title, self.episode), 'url': self.podcasturl})
+        self.posts = posts
+        self.saveArtifact(POSTS_FILE, self.posts)
+
+    def post(self):
+        posts = self.getPosts()
+        # Posts that already went out on an earlier run are not posted again
+        posted = dict()
+        if os.path.exists(self.artifact(POSTED_FILE)):
+            for p in self.loadArtifact(POSTED_FILE, 'post'):
+                posted[(p['text'], p['url'])] = p
+        if self.bskybot is None:
+            self.bskybot = BlueskyPostBot(self.configfile)
+        try:
+            for p in posts:
+                key = (p['text'], p['url'])
+                if key in posted:
+                    print(f"already posted: {p['text']}", file=sys.stderr)
+                    continue
+                if self.debug:
+                    print(f"Text: {p['text']}")
+                    print(f"URL : {p['url']}")
+                    continue
+                resp = self.bskybot.create_post(p['text'], p['url'])
+                if resp is None:
+                    raise Exception(f"Failed to post: {p['text']}")
+                posted[key] = {'text': p['text'], 'url': p['url'], 'uri': resp.get('uri'), 'cid': resp.get('cid')}
+        finally:
+            if not self.debug:
+                self.saveArtifact(POSTED_FILE, list(posted.values()))
+
+    def run(self, stages):
+        for stage in STAGES:
+            if stage in stages:
+                print(f"stage: {stage}", file=sys.stderr)
+                with metrics.timer('stage.' + stage):
+                    getattr(self, stage)()
+
+
+def version():
+    print("Version: {}".format(__version__))
+
+
+def parseCommandLine():
+    description = (
+            'Script to extract the metadata out of a Podcast, render '
+            'the show notes and post it to bluesky.\n'
+            '---------------------------------------------'
+            '-----------------------------\n'
+            )
+    parser = ArgParser(description=description)
+    parser.add_argument('-v', '--version', action='store_true', help='Show version numbers and exit')
+    parser.add_argument('-c', '--configfile', help='Config file, default config.env', default="config.env")
+    parser.add_argument('-i', '--inputfile', help='Specify the podcast file to extract', default="")
+    parser.add_argument('-t', '--title', help='Podcast Title for posting', default="")
+    parser.add_argument('-e', '--episode', type=int, help='Episode number', default=0)
+    parser.add_argument('-p', '--podcasturl', help='URL to podcast for posting to bluesky', default="")
+    parser.add_argument('-w', '--workdir', help='Directory for the stage artifacts, default publish<episode>')
+    parser.add_argument('-S', '--stage', action='append', choices=STAGES,
+                        help='Only run this stage, can be repeated. Default is all stages')
+    parser.add_argument('-s', '--showtime', action='store_true', help='Display the start time of each segment')
+    parser.add_argument('-d', '--debug', action='store_true', help='Print the posts instead of posting them')
+    instrumentation.addArguments(parser)
+
+    options = parser.parse_args()
+    if isinstance(options, tuple):
+        args = options[0]
+    else:
+        args = options
+    del options
+
+    if args.version:
+        version()
+        raise SystemExit()
+
+    metrics.configure(args)
+    return args
+
+
+def main():
+    try:
+        args = parseCommandLine()
+        workdir = args.workdir
+        if not workdir:
+            if args.episode > 0:
+                workdir = f"publish{args.episode}"
+            elif args.inputfile:
+                workdir = "publish-" + os.path.splitext(os.path.basename(args.inputfile))[0]
+            else:
+                print("workdir, episode or inputfile is required")
+                raise SystemExit(-1)
+        os.makedirs(workdir, exist_ok=True)
+
+        publisher = PodcastPublisher(workdir, inputfile=args.inputfile, configfile=args.configfile,
+                                     title=args.title, episode=args.episode, podcasturl=args.podcasturl,
+                                     showtime=args.showtime, debug=args.debug)
+        publisher.run(args.stage or STAGES)
+    except KeyboardInterrupt:
+        print("\nCancelling...\n")
+    except Exception as e:
+        print(e)
+        raise SystemExit(-1)
+    finally:
+        metrics.finish()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+#!/bin/bash
+
+if [ $# -lt 3 ]; then
+    echo "usage: $0 <episode> <title> <slug> [publish.py args, e.g. -S post]"
+    echo "e.g.   $0 377 \"Competitive Puzzling\" 377-competitive-puzzling"
+    exit 1
+fi
+
+if echo "$HOME" | grep -q "wuehler"; then
+    echo "Eric's System"
+    fname="$HOME/Podcast/mostlysecurity${1}.mp3"
+else
+    echo "Jon's System"
+    fname="$HOME/mostlysecurity/finals/mostlysecurity${1}.mp3"
+fi
+
+
+episode=${1}
+title=${2}
+slug=${3}
+shift 3
+echo "./publish.py -i ${fname} -e ${episode} -t \"${title}\" -p http://podcast.mostlysecurity.com/${slug} -s $@"
+./publish.py -i ${fname} -e ${episode} -t "${title}" -p http://podcast.mostlysecurity.com/${slug} -s "$@"
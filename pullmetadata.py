@@ -11,8 +11,14 @@ import mutagen
 from mutagen import id3
 from argparse import ArgumentParser as ArgParser
 
+import instrumentation
+from instrumentation import metrics
+
 
 class PodcastMetadata:
+    texttypes = [id3.TALB, id3.TPE1, id3.TPE2, id3.TPE3, id3.TIT1, id3.TIT2, id3.TIT3, id3.TENC, id3.TLEN, id3.COMM, id3.USLT]
+    tstypes = [id3.TDRC, id3.TYER]
+
     def __init__(self, inputfile):
         self.inputfile = inputfile
 
@@ -23,9 +29,8 @@ class PodcastMetadata:
             return d.text[0]
 
     def isText(self, d):
-        texttypes = [id3.TALB, id3.TPE1, id3.TPE2, id3.TPE3, id3.TIT1, id3.TIT2, id3.TIT3, id3.TENC, id3.TLEN, id3.COMM, id3.USLT]
         is_text = False
-        for t in texttypes:
+        for t in self.texttypes:
             if isinstance(d, t):
                 is_text = True
                 break
@@ -35,9 +40,8 @@ class PodcastMetadata:
         return d.text[0].get_text()
 
     def isTimestamp(self, d):
-        tstypes = [id3.TDRC, id3.TYER]
         is_ts = False
-        for t in tstypes:
+        for t in self.tstypes:
             if isinstance(d, t):
                 is_ts = True
                 break
@@ -68,24 +72,29 @@ class PodcastMetadata:
         return chapdata
 
     def extractMetadata(self):
-        mp3 = mutagen.File(self.inputfile)
+        with metrics.timer('file_open'):
+            f = open(self.inputfile, 'rb')
+        with f:
+            with metrics.timer('tag_parse'):
+                mp3 = mutagen.File(f)
         metadata = dict()
         metadata['CHAP'] = dict()
-        for key in mp3.keys():
-            data = mp3.tags.getall(key)
-            for d in data:
-                if self.isText(d):
-                    metadata[type(d).__name__] = self.extractText(d)
-                elif self.isTimestamp(d):
-                    metadata[type(d).__name__] = self.extractTimestamp(d)
-                elif isinstance(d, id3.CTOC):
-                    metadata['CTOC'] = self.extractChapterTOC(d)
-                elif isinstance(d, id3.CHAP):
-                    metadata['CHAP'] = self.appendChapterData(d, metadata['CHAP'])
-                elif isinstance(d, id3.APIC):
-                    metadata['APIC'] = "Has Image Data"
-                else:
-                    metadata[type(d).__name__] = "Unknown type, fixme"
+        with metrics.timer('tag_extract'):
+            for key in mp3.keys():
+                data = mp3.tags.getall(key)
+                for d in data:
+                    if self.isText(d):
+                        metadata[type(d).__name__] = self.extractText(d)
+                    elif self.isTimestamp(d):
+                        metadata[type(d).__name__] = self.extractTimestamp(d)
+                    elif isinstance(d, id3.CTOC):
+                        metadata['CTOC'] = self.extractChapterTOC(d)
+                    elif isinstance(d, id3.CHAP):
+                        metadata['CHAP'] = self.appendChapterData(d, metadata['CHAP'])
+                    elif isinstance(d, id3.APIC):
+                        metadata['APIC'] = "Has Image Data"
+                    else:
+                        metadata[type(d).__name__] = "Unknown type, fixme"
         return metadata
 
 
@@ -111,10 +120,9 @@ def getStartTime(starttime):
     return ""
 
 
-def createMarkdown(metadata):
-    print("")
-    print(metadata['USLT'])
-    print("")
+@metrics.timed('render')
+def renderMarkdown(metadata, showtime=False):
+    lines = ["", metadata['USLT'], ""]
     for cch in metadata['CTOC']:
         ch = metadata['CHAP'][cch]
         st = ""
@@ -123,15 +131,15 @@ def createMarkdown(metadata):
             st = getStartTime(ch.get('start_time'))
             std = " - "
         if ch.get('url'):
-            print("{}{}[{}]({})".format(st,std,ch.get('text'), ch.get('url')))
+            lines.append("{}{}[{}]({})".format(st,std,ch.get('text'), ch.get('url')))
         else:
-            print("{}{}{}".format(st,std,ch.get('text')))
-    print("")
+            lines.append("{}{}{}".format(st,std,ch.get('text')))
+    lines.append("")
+    return "\n".join(lines)
 
-def createHTML(metadata):
-    print('')
-    print('<p>{}</p>'.format(metadata['USLT']))
-    print('<ul>')
+@metrics.timed('render')
+def renderHTML(metadata, showtime=False):
+    lines = ['', '<p>{}</p>'.format(metadata['USLT']), '<ul>']
     for cch in metadata['CTOC']:
         ch = metadata['CHAP'][cch]
         st = ""
@@ -140,10 +148,17 @@ def createHTML(metadata):
             st = getStartTime(ch.get('start_time'))
             std = " - "
         if ch.get('url'):
-            print('<li>{}{}<a href="{}" target="_blank">{}</a></li>'.format(st, std, ch.get('url'), ch.get('text')))
+            lines.append('<li>{}{}<a href="{}" target="_blank">{}</a></li>'.format(st, std, ch.get('url'), ch.get('text')))
         else:
-            print('<li>{}{}{}</li>'.format(st, std, ch.get('text')))
-    print('</ul>')
+            lines.append('<li>{}{}{}</li>'.format(st, std, ch.get('text')))
+    lines.append('</ul>')
+    return "\n".join(lines)
+
+def createMarkdown(metadata):
+    print(renderMarkdown(metadata, showtime))
+
+def createHTML(metadata):
+    print(renderHTML(metadata, showtime))
 
 
 def version():
@@ -165,6 +180,7 @@ def parseCommandLine():
     parser.add_argument('-s', '--showtime', action='store_true', help='Display the start time of each segment')
     parser.add_argument('-o', '--output', help="Specify format of output: MD, JSON, HTML", default=output)
     parser.add_argument('-d', '--debug', action='store_true', help='Prints extra stuff to stdout')
+    instrumentation.addArguments(parser)
     
     options = parser.parse_args()
     if isinstance(options, tuple):
@@ -176,6 +192,8 @@ def parseCommandLine():
     if args.version:
         version()
     
+    metrics.configure(args)
+
     if args.debug:
         debug = args.debug
 
@@ -212,6 +230,8 @@ def main():
         parseCommandLine()
     except KeyboardInterrupt:
         print("\nCancelling...\n")
+    finally:
+        metrics.finish()
 
 
 if __name__ == '__main__':